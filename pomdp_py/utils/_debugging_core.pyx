@@ -0,0 +1,65 @@
+"""Tree traversals used by TreeDebugger (pomdp_py.utils.debugging),
+compiled for speed on large search trees."""
+
+from pomdp_py.algorithms.po_uct cimport TreeNode, VNode
+
+
+cpdef dict tree_stats_helper(TreeNode root, max_depth=None):
+    """
+    tree_stats_helper(TreeNode root, max_depth=None)
+    Returns the statistics of the subtree rooted at `root`, gathered by an
+    iterative depth-first traversal into C counters. Only nodes up to
+    `max_depth` (if not None) are counted. The "max_depth" entry is the
+    depth of the deepest VNode, relative to `root`.
+    """
+    cdef bint by_depth = max_depth is not None
+    cdef long limit = max_depth if by_depth else 0
+    cdef long total_vnodes = 0, total_qnodes = 0
+    cdef long total_vnodes_children = 0, total_qnodes_children = 0
+    cdef long max_vnodes_children = 0, max_qnodes_children = 0
+    cdef long deepest = 0
+
+    cdef TreeNode node, child
+    cdef long depth, child_depth, num_children
+    # Nodes to visit, and their depths
+    cdef list worklist = []
+    cdef list depths = []
+    if not by_depth or limit >= 0:
+        worklist.append(root)
+        depths.append(0)
+    while len(worklist) > 0:
+        node = worklist.pop()
+        depth = depths.pop()
+        num_children = len(node.children)
+        if isinstance(node, VNode):
+            total_vnodes += 1
+            total_vnodes_children += num_children
+            if num_children > max_vnodes_children:
+                max_vnodes_children = num_children
+            if depth > deepest:
+                deepest = depth
+        else:
+            total_qnodes += 1
+            total_qnodes_children += num_children
+            if num_children > max_qnodes_children:
+                max_qnodes_children = num_children
+
+        for child in node.children.values():
+            if isinstance(child, VNode):
+                child_depth = depth + 1
+            else:
+                child_depth = depth
+            if by_depth and child_depth > limit:
+                continue
+            worklist.append(child)
+            depths.append(child_depth)
+
+    return {
+        "total_vnodes": total_vnodes,
+        "total_qnodes": total_qnodes,
+        "total_vnodes_children": total_vnodes_children,
+        "total_qnodes_children": total_qnodes_children,
+        "max_vnodes_children": max_vnodes_children,
+        "max_qnodes_children": max_qnodes_children,
+        "max_depth": deepest,
+    }
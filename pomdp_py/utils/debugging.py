@@ -89,12 +89,19 @@ To explore more features, browse the list of methods in the documentation.
 """
 
 import sys
+from collections import deque
 from pomdp_py.algorithms.po_uct import TreeNode, QNode, VNode, RootVNode
 from pomdp_py.utils import typ, similar, special_char
+from pomdp_py.utils._debugging_core import tree_stats_helper
 
 SIMILAR_THRESH = 0.6
 DEFAULT_MARK_COLOR = "blue"
 MARKED = {}  # tracks marked nodes on tree
+_MISSING = object()  # sentinel for dict lookups
+
+
+# Attributes of _NodePP objects; "children" is inherited from TreeNode.
+_NODE_PP_SLOTS = ("parent_edge", "parent", "original", "print_children", "_edge_strs")
 
 
 def _node_pp(node, e=None, p=None, o=None):
@@ -108,11 +115,19 @@ def _node_pp(node, e=None, p=None, o=None):
 
 
 class _NodePP:
+    # Attributes are stored in slots declared by the subclasses, which also
+    # derive from the QNode/VNode extension types; a non-empty __slots__ here
+    # would conflict with their instance layout.
+    __slots__ = ()
+
     def __init__(self, node, parent_edge=None, parent=None, original=None):
         """node: either VNode or QNode (the actual node on the tree)"""
         self.parent_edge = parent_edge
         self.parent = parent
         self.children = node.children
+        # string form of edges, filled in on demand by edge_str; used for
+        # sorting and fuzzy matching
+        self._edge_strs = {}
         self.print_children = True
         if original is None:
             self.original = node
@@ -132,15 +147,43 @@ class _NodePP:
     def marked(self):
         return id(self.original) in MARKED
 
+    def sorted_edges(self):
+        """Returns the edges to children, sorted by their string form"""
+        return sorted(self.children, key=self.edge_str)
+
+    def edge_str(self, edge):
+        """Returns str(edge), computed once per edge. Children may be added
+        to the tree after this node is created, so the string is computed
+        on first use."""
+        edge_str = self._edge_strs.get(edge)
+        if edge_str is None:
+            edge_str = str(edge)
+            self._edge_strs[edge] = edge_str
+        return edge_str
+
     def to_edge(self, key):
         if key in self.children:
             return key
-        elif type(key) == int:
-            edges = list(sorted_by_str(self.children.keys()))
+        elif isinstance(key, int) and not isinstance(key, bool):
+            edges = self.sorted_edges()
             return edges[key]
-        elif type(key) == str:
-            chosen = max(self.children.keys(), key=lambda edge: similar(str(edge), key))
-            if similar(str(chosen), key) >= SIMILAR_THRESH:
+        elif isinstance(key, str):
+            chosen, best_score = None, -1.0
+            key_len = len(key)
+            for edge in self.children:
+                edge_str = self.edge_str(edge)
+                # similar() is at most 2*min(len)/(sum of len); skip
+                # edges whose score cannot pass the threshold or beat
+                # the best score so far.
+                bound = _similarity_upper_bound(len(edge_str), key_len)
+                if bound < SIMILAR_THRESH or bound <= best_score:
+                    continue
+                score = similar(edge_str, key)
+                if score > best_score:
+                    chosen, best_score = edge, score
+                    if score == 1.0:
+                        break
+            if best_score >= SIMILAR_THRESH:
                 return chosen
         raise ValueError("Cannot access children with key {}".format(key))
 
@@ -157,8 +200,11 @@ class _NodePP:
           the most similar one will be chosen; The threshold
           of similarity is SIMILAR_THRESH
         """
-        edge = self.to_edge(key)
-        c = self.children[edge]
+        edge = key
+        c = self.children.get(key, _MISSING)
+        if c is _MISSING:
+            edge = self.to_edge(key)
+            c = self.children[edge]
         if isinstance(c, _NodePP):
             original = c.original
         else:
@@ -206,99 +252,85 @@ class _NodePP:
 
     def print_tree(self, **options):
         """Prints the tree, rooted at self"""
-        _NodePP._print_tree_helper(self, 0, "", [None], -1, **options)
+        _NodePP._print_tree_helper(self, **options)
 
     @staticmethod
-    def _print_tree_helper(
-        root,
-        depth,  # depth of root
-        parent_edge,
-        branch_positions,  # list of 'first', 'middle', 'last' for each level prior to root
-        child_index,  # Index of the root as a child of parent
-        max_depth=None,
-        print_type="summary",
-    ):
+    def _print_tree_helper(root, max_depth=None, print_type="summary"):
         """
-        pos_among_children is either 'first', 'middle', or 'last'
+        Prints the tree rooted at `root` through an iterative depth-first
+        traversal. Each entry on the stack is a tuple
+
+            (node, depth, prefix, branch, child_index)
+
+        where `prefix` is the branch string drawn for all levels above the
+        node's parent, `branch` is the connector drawn right before the node
+        ("├─── ", "└─── ", or "" for the root), and `child_index` is the index
+        of the node among its parent's children (-1 for the root).
         """
-        if max_depth is not None and depth > max_depth:
+        if max_depth is not None and max_depth < 0:
             return
-        if root is None:
-            return
-
-        # Print the tree branches for all levels up to current root
-        branches = ""
-        preceding_positions = branch_positions[
-            :-1
-        ]  # all positions except for current root
-        for pos in preceding_positions:
-            if pos is None:
+        stack = [(root, 0, "", "", -1)]
+        while stack:
+            node, depth, prefix, branch, child_index = stack.pop()
+
+            node.print_children = False
+            line = prefix + branch
+            if child_index >= 0:
+                line += str(child_index).translate(special_char.SUBSCRIPT)
+            line += str(node)
+            if isinstance(node, VNode):
+                line += typ.cyan("(depth=" + str(depth) + ")")
+            print(line)
+
+            # Children of a QNode are VNodes one level deeper; At max_depth,
+            # none of them would be printed.
+            if max_depth is not None and depth >= max_depth and isinstance(node, QNode):
                 continue
-            elif pos == "first" or pos == "middle":
-                branches += "│    "
-            else:  # "last"
-                branches += "     "
-
-        last_position = branch_positions[-1]
-        if last_position is None:
-            pass
-        elif last_position == "first" or last_position == "middle":
-            branches += "├─── "
-        else:  # last
-            branches += "└─── "
-
-        root.print_children = False
-        if child_index >= 0:
-            line = (
-                branches
-                + str(child_index).translate(special_char.SUBSCRIPT)
-                + str(root)
-            )
-        else:
-            line = branches + str(root)
-        if isinstance(root, VNode):
-            line += typ.cyan("(depth=" + str(depth) + ")")
-
-        print(line)
-
-        for i, c in enumerate(sorted_by_str(root.children)):
-            skip = True
-            if root[c].marked:
-                skip = False
-            elif print_type == "complete":
-                skip = False
-            elif root[c].num_visits > 1:
-                skip = False
-            if print_type == "marked-only" and not root[c].marked:
-                skip = True
 
-            if not skip:
-                if isinstance(root[c], QNode):
+            if branch == "├─── ":
+                child_prefix = prefix + "│    "
+            elif branch == "└─── ":
+                child_prefix = prefix + "     "
+            else:
+                child_prefix = prefix
+
+            # Push children in reverse order so that they are popped
+            # (and printed) in sorted order.
+            edges = node.sorted_edges()
+            last = len(edges) - 1
+            for i in range(last, -1, -1):
+                # Decide on the actual child node; only wrap it for
+                # printing if it is not skipped.
+                child = node.children[edges[i]]
+                if isinstance(child, QNode):
                     next_depth = depth
                 else:
                     next_depth = depth + 1
-
-                if i == len(root.children) - 1:
-                    next_pos = "last"
-                elif i == 0:
-                    next_pos = "first"
-                else:
-                    next_pos = "middle"
-
-                _NodePP._print_tree_helper(
-                    root[c],
-                    next_depth,
-                    c,
-                    branch_positions + [next_pos],
-                    i,
-                    max_depth=max_depth,
-                    print_type=print_type,
-                )
+                if max_depth is not None and next_depth > max_depth:
+                    continue
+                marked = id(child) in MARKED
+                skip = True
+                if marked:
+                    skip = False
+                elif print_type == "complete":
+                    skip = False
+                elif child.num_visits > 1:
+                    skip = False
+                if print_type == "marked-only" and not marked:
+                    skip = True
+
+                if not skip:
+                    child_branch = "└─── " if i == last else "├─── "
+                    stack.append(
+                        (node[edges[i]], next_depth, child_prefix, child_branch, i)
+                    )
 
 
 class _QNodePP(_NodePP, QNode):
     """QNode for better printing"""
 
+    __slots__ = _NODE_PP_SLOTS
+
     def __init__(self, qnode, **kwargs):
         QNode.__init__(self, qnode.num_visits, qnode.value)
         _NodePP.__init__(self, qnode, **kwargs)
@@ -312,6 +344,8 @@ class _QNodePP(_NodePP, QNode):
 class _VNodePP(_NodePP, VNode):
     """VNode for better printing"""
 
+    __slots__ = _NODE_PP_SLOTS
+
     def __init__(self, vnode, **kwargs):
         VNode.__init__(self, vnode.num_visits)
         _NodePP.__init__(self, vnode, **kwargs)
@@ -344,7 +378,7 @@ class TreeDebugger:
 
         self.tree = _node_pp(tree)
         self.current = self.tree  # points to the node the user is interacting with
-        self._stats_cache = {}
+        self._stats = None  # statistics of the current subtree; see _get_stats
 
     def __str__(self):
         return str(self.current)
@@ -365,12 +399,25 @@ class TreeDebugger:
             return self.current[key]
 
     def _get_stats(self):
-        if id(self.current) in self._stats_cache:
-            stats = self._stats_cache[id(self.current)]
-        else:
-            stats = TreeDebugger.tree_stats(self.current)
-            self._stats_cache[id(self.current)] = stats
-        return stats
+        """Returns the statistics of the tree rooted at the current node.
+        They are computed again only if the current node has changed, or
+        has been visited since they were computed (i.e. planning has run
+        through it, and may have grown the tree). Visit counts are read
+        from the actual node on the tree; the count on its _NodePP wrapper
+        is only a copy taken when the wrapper was created."""
+        node = self.current.original
+        cached = self._stats
+        if (
+            cached is None
+            or cached["id"] != id(node)
+            or cached["num_visits"] != node.num_visits
+        ):
+            cached = self._stats = {
+                "id": id(node),
+                "num_visits": node.num_visits,
+                "stats": TreeDebugger.tree_stats(node),
+            }
+        return cached["stats"]
 
     def num_nodes(self, kind="all"):
         """
@@ -447,26 +494,25 @@ class TreeDebugger:
             raise ValueError(
                 "Depth {} is out of range (0-{})".format(depth, self.depth)
             )
+        # Breadth-first traversal on the actual tree, down to the given
+        # depth; The order of nodes within a layer does not matter, so
+        # children are not sorted.
         nodes = []
-        self._layer_helper(self.current, 0, depth, nodes)
-        return nodes
-
-    def _layer_helper(
-        self, root, current_depth, target_depth, nodes, as_debuggers=True
-    ):
-        if current_depth == target_depth:
-            if isinstance(root, VNode):
+        worklist = deque([(self.current.original, 0)])
+        while len(worklist) > 0:
+            node, node_depth = worklist.popleft()
+            if isinstance(node, VNode) and node_depth == depth:
                 if as_debuggers:
-                    nodes.append(TreeDebugger(root.original))
-                else:
-                    nodes.append(root)
-        else:
-            for c in sorted_by_str(root.children):
-                if isinstance(root[c], QNode):
-                    next_depth = current_depth
+                    nodes.append(TreeDebugger(node))
                 else:
-                    next_depth = current_depth + 1
-                self._layer_helper(root[c], next_depth, target_depth, nodes)
+                    nodes.append(_node_pp(node))
+                continue
+            for child in node.children.values():
+                if isinstance(child, QNode):
+                    worklist.append((child, node_depth))
+                elif node_depth < depth:
+                    worklist.append((child, node_depth + 1))
+        return nodes
 
     @property
     def leaf(self):
@@ -603,27 +649,37 @@ class TreeDebugger:
             color = typ.red
             opposite_color = typ.green
 
-        output = ""
+        parts = []
         if parent_edge is not None:
-            output += opposite_color(str(parent_edge)) + "⟶"
-
-        output += color(str(node.__class__.__name__)) + "(n={}, v={:.3f})".format(
-            node.num_visits, node.value
+            parts.append(opposite_color(str(parent_edge)) + "⟶")
+        parts.append(
+            color(str(node.__class__.__name__))
+            + "(n={}, v={:.3f})".format(node.num_visits, node.value)
         )
         if include_children:
-            output += "\n"
-            for i, action in enumerate(sorted_by_str(node.children)):
-                child = node.children[action]
-                child_info = TreeDebugger.single_node_str(child, include_children=False)
-
-                spaces = "    " * indent
-                output += "{}- [{}] {}: {}".format(
-                    spaces, i, typ.white(str(action)), child_info
+            if isinstance(node, _NodePP):
+                edges = node.sorted_edges()
+            else:
+                edges = sorted_by_str(node.children)
+            # local references to avoid repeated lookups in the loop
+            white = typ.white
+            children = node.children
+            line_format = ("    " * indent + "- [{}] {}: {}").format
+            single_node_str = TreeDebugger.single_node_str
+
+            parts.append("\n")
+            parts.append(
+                "\n".join(
+                    line_format(
+                        i,
+                        white(str(action)),
+                        single_node_str(children[action], include_children=False),
+                    )
+                    for i, action in enumerate(edges)
                 )
-                if i < len(node.children) - 1:
-                    output += "\n"
-            output += "\n"
-        return output
+            )
+            parts.append("\n")
+        return "".join(parts)
 
     @staticmethod
     def preferred_actions(root, max_depth=None):
@@ -631,40 +687,57 @@ class TreeDebugger:
         Print out the currently preferred actions up to given `max_depth`
         """
         seq = []
-        TreeDebugger._preferred_actions_helper(root, 0, seq, max_depth=max_depth)
+        for edge, child, equally_good in TreeDebugger._preferred_chain(
+            root, max_depth=max_depth
+        ):
+            seq.append(edge)
+            if isinstance(child, QNode):
+                print("  %s  %s" % (typ.yellow(str(edge)), str(equally_good)))
         return seq
 
     @staticmethod
-    def _preferred_actions_helper(root, depth, seq, max_depth=None):
+    def _preferred_chain(root, max_depth=None):
+        """
+        Yields (edge, child, equally_good) for each step along the path of
+        preferred children from `root`, where `equally_good` lists the other
+        edges out of a VNode whose children have the same value.
+        """
+        # Traverse the actual tree nodes rather than _NodePP wrappers
+        node = getattr(root, "original", root)
+        depth = 0
         # don't care about last layer action because it's outside of planning
         # horizon and only has initial value.
-        if max_depth is not None and depth > max_depth:
-            return
-        if root is None or len(root.children) == 0:
-            return
-        best_child = root.to_edge(0)
-        best_value = root[0].value
-        for c in root.children:
-            if root[c].value > best_value:
-                best_child = c
-                best_value = root[c].value
-        seq.append(best_child)
-        equally_good = []
-        if isinstance(root, VNode):
-            for c in root.children:
-                if not (c == best_child) and root[c].value == best_value:
-                    equally_good.append(c)
-
-        if best_child is not None and root[best_child] is not None:
-            if isinstance(root[best_child], QNode):
-                print("  %s  %s" % (typ.yellow(str(best_child)), str(equally_good)))
-                next_depth = depth
+        while len(node.children) > 0 and (max_depth is None or depth <= max_depth):
+            # Single pass over the children, evaluating each once.
+            best_child, best_node, best_value = None, None, None
+            num_best = 0
+            values = []
+            for c, child in node.children.items():
+                value = child.value
+                values.append((c, value))
+                if best_child is None or value > best_value:
+                    best_child, best_node, best_value = c, child, value
+                    num_best = 1
+                elif value == best_value:
+                    num_best += 1
+            if num_best > 1:
+                # The first child as printed (index 0) is kept among equally
+                # good children. Only then are edges converted to strings.
+                first_child = min(node.children, key=str)
+                if node.children[first_child].value == best_value:
+                    best_child = first_child
+                    best_node = node.children[first_child]
+            if isinstance(node, VNode):
+                equally_good = [
+                    c for c, value in values if c != best_child and value == best_value
+                ]
             else:
-                next_depth = depth + 1
+                equally_good = []
+            yield best_child, best_node, equally_good
 
-            TreeDebugger._preferred_actions_helper(
-                root[best_child], next_depth, seq, max_depth=max_depth
-            )
+            if isinstance(best_node, VNode):
+                depth += 1
+            node = best_node
 
     def path(self, dest):
         """alias for path_to;
@@ -710,48 +783,25 @@ class TreeDebugger:
 
     @staticmethod
     def tree_stats(root, max_depth=None):
-        """Gether statistics about the tree"""
-        stats = {
-            "total_vnodes": 0,
-            "total_qnodes": 0,
-            "total_vnodes_children": 0,
-            "total_qnodes_children": 0,
-            "max_vnodes_children": 0,
-            "max_qnodes_children": 0,
-            "max_depth": 0,
-        }
-        TreeDebugger._tree_stats_helper(root, 0, stats, max_depth=max_depth)
+        """Gether statistics about the tree. The traversal is compiled (see
+        _debugging_core); num_nodes, depth and the other statistics
+        queries of TreeDebugger are answered by it.
+
+        Args:
+            root (TreeNode): root of the tree
+            max_depth (int): if not None, only nodes up to this depth are counted
+        """
+        stats = tree_stats_helper(root, max_depth=max_depth)
         stats["num_visits"] = root.num_visits
         stats["value"] = root.value
         return stats
 
-    @staticmethod
-    def _tree_stats_helper(root, depth, stats, max_depth=None):
-        if max_depth is not None and depth > max_depth:
-            return
-        else:
-            if isinstance(root, VNode):
-                stats["total_vnodes"] += 1
-                stats["total_vnodes_children"] += len(root.children)
-                stats["max_vnodes_children"] = max(
-                    stats["max_vnodes_children"], len(root.children)
-                )
-                stats["max_depth"] = max(stats["max_depth"], depth)
-            else:
-                stats["total_qnodes"] += 1
-                stats["total_qnodes_children"] += len(root.children)
-                stats["max_qnodes_children"] = max(
-                    stats["max_qnodes_children"], len(root.children)
-                )
 
-            for c in root.children:
-                if isinstance(root[c], QNode):
-                    next_depth = depth
-                else:
-                    next_depth = depth + 1
-                TreeDebugger._tree_stats_helper(
-                    root[c], next_depth, stats, max_depth=max_depth
-                )
+def _similarity_upper_bound(alen, blen):
+    """Upper bound of similar(a, b) given only the lengths of a and b."""
+    if alen + blen == 0:
+        return 1.0
+    return 2.0 * min(alen, blen) / (alen + blen)
 
 
 def sorted_by_str(enumerable):
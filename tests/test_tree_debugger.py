@@ -1,3 +1,5 @@
+import contextlib
+import io
 import random
 from pomdp_py.problems.tiger import TigerProblem, test_planner
 import pomdp_py
@@ -30,6 +32,13 @@ def test_tree_debugger_tiger(debug_tree=False):
     print("Printing tree up to depth 1")
     dd.p(1)
 
+    # Printing up to depth 1 shows no VNodes deeper than that
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        dd.p(1)
+    assert "(depth=1)" in output.getvalue()
+    assert "(depth=2)" not in output.getvalue()
+
     # There exists a path from the root to nodes in the tree
     for i in range(dd.nl):
         n = dd.l(i)[0]
@@ -39,8 +48,146 @@ def test_tree_debugger_tiger(debug_tree=False):
     test_planner(tiger_problem, pouct, nsteps=3, debug_tree=debug_tree)
 
 
+def test_tree_debugger_children_added_later():
+    root = pomdp_py.VNode(2)
+    root["listen"] = pomdp_py.QNode(2, -1.0)
+    dd = TreeDebugger(root)
+    with contextlib.redirect_stdout(io.StringIO()):
+        dd.current.print_tree(max_depth=None)
+
+    # The tree may grow (e.g. by planning again) after nodes are wrapped
+    root["open-left"] = pomdp_py.QNode(2, -10.0)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        dd.current.print_tree(max_depth=None)
+    assert "open-left" in output.getvalue()
+    assert dd["open-l"].parent_edge == "open-left"
+
+
+def _plan_tiger():
+    """Returns the Tiger problem, after planning with POUCT, and the planner.
+    The search tree is at tiger_problem.agent.tree."""
+    tiger_problem = TigerProblem.create("tiger-left", 0.5, 0.15)
+    pouct = pomdp_py.POUCT(
+        max_depth=4,
+        discount_factor=0.95,
+        num_sims=1024,
+        exploration_const=200,
+        rollout_policy=tiger_problem.agent.policy_model,
+    )
+    pouct.plan(tiger_problem.agent)
+    return tiger_problem, pouct
+
+
+def _walk(node, depth=0, layers=None):
+    """Returns (number of VNodes, number of QNodes, depth) of the tree
+    rooted at node, by a plain recursive walk. If `layers` is given, it
+    maps from depth to the list of VNodes at that depth."""
+    nv, nq = (1, 0) if isinstance(node, pomdp_py.VNode) else (0, 1)
+    if layers is not None and isinstance(node, pomdp_py.VNode):
+        layers.setdefault(depth, []).append(node)
+    max_depth = depth
+    for child in node.children.values():
+        child_depth = depth + 1 if isinstance(child, pomdp_py.VNode) else depth
+        cv, cq, cd = _walk(child, child_depth, layers)
+        nv, nq, max_depth = nv + cv, nq + cq, max(max_depth, cd)
+    return nv, nq, max_depth
+
+
+def _check_against_walk(dd):
+    layers = {}
+    nv, nq, depth = _walk(dd.current.original, layers=layers)
+    assert (dd.nv, dd.nq, dd.nn, dd.d) == (nv, nq, nv + nq, depth)
+    for d in range(dd.nl):
+        assert sorted(id(n.current.original) for n in dd.l(d)) == sorted(
+            id(n) for n in layers.get(d, [])
+        )
+
+
+def test_tree_debugger_stats_and_layers():
+    tiger_problem, pouct = _plan_tiger()
+    dd = TreeDebugger(tiger_problem.agent.tree)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        _check_against_walk(dd)
+        # at a QNode and a VNode below the root, and back at the root
+        dd.s("listen")
+        _check_against_walk(dd)
+        dd.s(0)
+        _check_against_walk(dd)
+        dd.back()
+        dd.back()
+        _check_against_walk(dd)
+
+        # The tree grows after the stats are computed; step to a new node
+        qnode = dd.current["listen"].original
+        vnode = pomdp_py.VNode(1)
+        vnode["listen"] = pomdp_py.QNode(1, -1.0)
+        qnode["new-observation"] = vnode
+        dd.s("listen")
+        dd.s("new-observation")
+        assert dd.nn == 2
+        dd.back()
+        _check_against_walk(dd)
+
+        # Planning again grows the tree through its root
+        dd.back()
+        assert dd.current == dd.root
+        nn = dd.nn
+        pouct.plan(tiger_problem.agent)
+        assert dd.nn > nn
+        _check_against_walk(dd)
+
+
+def _reference_tree_stats(node, max_depth=None, depth=0, stats=None):
+    """Plain Python version of TreeDebugger.tree_stats, without
+    num_visits and value."""
+    if stats is None:
+        stats = dict.fromkeys(
+            [
+                "total_vnodes",
+                "total_qnodes",
+                "total_vnodes_children",
+                "total_qnodes_children",
+                "max_vnodes_children",
+                "max_qnodes_children",
+                "max_depth",
+            ],
+            0,
+        )
+    if max_depth is not None and depth > max_depth:
+        return stats
+    kind = "vnodes" if isinstance(node, pomdp_py.VNode) else "qnodes"
+    stats["total_" + kind] += 1
+    stats["total_" + kind + "_children"] += len(node.children)
+    stats["max_" + kind + "_children"] = max(
+        stats["max_" + kind + "_children"], len(node.children)
+    )
+    if kind == "vnodes":
+        stats["max_depth"] = max(stats["max_depth"], depth)
+    for child in node.children.values():
+        child_depth = depth + 1 if isinstance(child, pomdp_py.VNode) else depth
+        _reference_tree_stats(child, max_depth, child_depth, stats)
+    return stats
+
+
+def test_tree_stats():
+    tiger_problem, _ = _plan_tiger()
+    tree = tiger_problem.agent.tree
+    qnode = next(iter(tree.children.values()))
+    for root in [tree, qnode]:
+        for max_depth in [None, -1, 0, 1, 2, 3, 10]:
+            stats = TreeDebugger.tree_stats(root, max_depth=max_depth)
+            assert stats.pop("num_visits") == root.num_visits
+            assert stats.pop("value") == root.value
+            assert stats == _reference_tree_stats(root, max_depth=max_depth)
+
+
 def run(verbose=False, debug_tree=False):
     test_tree_debugger_tiger(debug_tree=debug_tree)
+    test_tree_debugger_children_added_later()
+    test_tree_debugger_stats_and_layers()
+    test_tree_stats()
 
 
 if __name__ == "__main__":